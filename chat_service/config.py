@@ -1,7 +1,13 @@
 import os
+from functools import cached_property, lru_cache
 from dotenv import load_dotenv
 
-load_dotenv()
+@lru_cache(maxsize=1)
+def _load_env_once():
+    """Read the .env file at most once per process"""
+    load_dotenv()
+
+_load_env_once()
 
 class Settings:
     # Database Configuration
@@ -11,21 +17,55 @@ class Settings:
     MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "chat_password")
     MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "chat_service")
     
+    # Keep MYSQL_POOL_SIZE + MYSQL_MAX_OVERFLOW below the server's max_connections
+    MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "25"))
+    MYSQL_MAX_OVERFLOW = int(os.getenv("MYSQL_MAX_OVERFLOW", "25"))
+    MYSQL_POOL_RECYCLE = int(os.getenv("MYSQL_POOL_RECYCLE", "1800"))
+    MYSQL_POOL_TIMEOUT = int(os.getenv("MYSQL_POOL_TIMEOUT", "10"))
+    
     MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
     MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "chat_messages")
+    MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+    MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+    MONGODB_WRITE_THREADS = int(os.getenv("MONGODB_WRITE_THREADS", "16"))  # Mongo writes run here, overlapping the MySQL writes
     
     # JWT Configuration
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
     ALGORITHM = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
     
+    # Password hashing cost (each +1 doubles hashing/verify time)
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    
     # Server Configuration
     HOST = os.getenv("HOST", "0.0.0.0")
     PORT = int(os.getenv("PORT", "8000"))
     DEBUG = os.getenv("DEBUG", "True").lower() == "true"
+    WORKERS = int(os.getenv("WORKERS", "1"))  # More than one requires REDIS_URL so broadcasts reach every worker
+    
+    # Logging: stays at INFO unless LOG_LEVEL is set explicitly; SQL echo is opt-in even in DEBUG
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    SQL_ECHO = os.getenv("SQL_ECHO", "False").lower() == "true"
+    
+    # WebSocket Configuration
+    WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))  # Frames buffered per connection before it is dropped
+    MESSAGE_WRITE_BATCH_SIZE = int(os.getenv("MESSAGE_WRITE_BATCH_SIZE", "100"))  # Max WebSocket messages stored per batched insert
+    REDIS_URL = os.getenv("REDIS_URL", "")  # Redis pub/sub backplane for chat broadcasts; in-process only when empty
     
     # Chat Configuration
     MAX_GROUP_MEMBERS = 100
     MAX_MESSAGE_LENGTH = 10000
+    
+    @cached_property
+    def MYSQL_URL(self) -> str:
+        """SQLAlchemy connection URL for MySQL"""
+        return f"mysql+mysqlconnector://{self.MYSQL_USER}:{self.MYSQL_PASSWORD}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}"
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the process-wide settings instance"""
+    _load_env_once()
+    return Settings()
 
-settings = Settings()
+settings = get_settings()
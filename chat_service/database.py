@@ -1,20 +1,36 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Table
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Table, Index
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.sql import func
+from datetime import datetime
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from config import settings
 import logging
 
 # MySQL Database Setup
-MYSQL_URL = f"mysql+mysqlconnector://{settings.MYSQL_USER}:{settings.MYSQL_PASSWORD}@{settings.MYSQL_HOST}:{settings.MYSQL_PORT}/{settings.MYSQL_DATABASE}"
-
-engine = create_engine(MYSQL_URL, echo=settings.DEBUG)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_engine(
+    settings.MYSQL_URL,
+    pool_size=settings.MYSQL_POOL_SIZE,
+    max_overflow=settings.MYSQL_MAX_OVERFLOW,
+    pool_pre_ping=True,  # Detect connections closed by MySQL's wait_timeout
+    pool_recycle=settings.MYSQL_POOL_RECYCLE,
+    pool_timeout=settings.MYSQL_POOL_TIMEOUT,
+    echo=settings.SQL_ECHO,
+    echo_pool=False
+)
+# Objects keep their loaded state after commit, so returning a just-written row needs no reload
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
 # MongoDB Setup
-mongo_client = MongoClient(settings.MONGODB_URL)
+mongo_client = MongoClient(
+    settings.MONGODB_URL,
+    maxPoolSize=settings.MONGODB_MAX_POOL_SIZE,
+    minPoolSize=settings.MONGODB_MIN_POOL_SIZE,
+    serverSelectionTimeoutMS=settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS
+)
 mongo_db = mongo_client[settings.MONGODB_DATABASE]
 messages_collection = mongo_db.messages
 
@@ -25,7 +41,9 @@ chat_participants = Table(
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
     Column('chat_id', Integer, ForeignKey('chats.id'), primary_key=True),
     Column('joined_at', DateTime, default=func.now()),
-    Column('is_admin', Boolean, default=False)
+    Column('is_admin', Boolean, default=False),
+    # The (user_id, chat_id) primary key can't serve chat_id-first lookups
+    Index('ix_chat_participants_chat_user', 'chat_id', 'user_id')
 )
 
 class User(Base):
@@ -38,7 +56,7 @@ class User(Base):
     full_name = Column(String(100))
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=func.now())
-    last_seen = Column(DateTime, default=func.now())
+    last_seen = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     chats = relationship("Chat", secondary=chat_participants, back_populates="participants")
@@ -51,7 +69,7 @@ class Chat(Base):
     name = Column(String(100))  # For group chats
     chat_type = Column(String(20), nullable=False)  # 'direct' or 'group'
     created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Boolean, default=True)
     
     # Relationships
@@ -74,6 +92,25 @@ class MessageMetadata(Base):
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", back_populates="sent_messages")
 
+# Chat history keyset pages and last-message times:
+# WHERE chat_id = ? AND is_deleted = FALSE ORDER BY timestamp DESC, id DESC
+Index(
+    'ix_message_metadata_chat_active_ts',
+    MessageMetadata.chat_id, MessageMetadata.is_deleted,
+    MessageMetadata.timestamp.desc(), MessageMetadata.id.desc()
+)
+# Word search on full_name (username prefix search is covered by its unique index)
+FULL_NAME_FULLTEXT_INDEX = 'ix_users_full_name_fulltext'
+Index(FULL_NAME_FULLTEXT_INDEX, User.full_name, mysql_prefix='FULLTEXT').ddl_if(dialect='mysql')
+
+# create_all skips tables that already exist, so indexes added since then are created by
+# migrate_mysql_indexes; each maps to the older index it replaces: {table: {new: old}}
+_REPLACED_MYSQL_INDEXES = {
+    # The new index also leads with chat_id, so the chat_id foreign key still has an index after the drop
+    MessageMetadata.__table__: {'ix_message_metadata_chat_active_ts': 'ix_message_metadata_chat_ts'},
+    User.__table__: {FULL_NAME_FULLTEXT_INDEX: 'ix_users_full_name_prefix'},
+}
+
 # Database dependency
 def get_db():
     db = SessionLocal()
@@ -91,17 +128,86 @@ def create_tables():
         Base.metadata.create_all(bind=engine)
         logging.info("Database tables created successfully")
     except Exception as e:
-        logging.error(f"Error creating database tables: {e}")
+        logging.error("Error creating database tables: %s", e)
         raise
 
+def mysql_index_names(bind, table_name: str) -> set:
+    """Names of the indexes a MySQL table currently has"""
+    return {index["name"] for index in inspect(bind).get_indexes(table_name)}
+
+def migrate_mysql_indexes():
+    """One-off migration: add indexes that create_all skipped on existing tables and drop the ones they replace"""
+    if engine.dialect.name != "mysql":
+        return
+    
+    for table, replacements in _REPLACED_MYSQL_INDEXES.items():
+        existing_indexes = mysql_index_names(engine, table.name)
+        for index in table.indexes:
+            if index.name not in replacements or index.name in existing_indexes:
+                continue
+            try:
+                index.create(bind=engine)
+                logging.info("Created MySQL index %s", index.name)
+            except DBAPIError:
+                # Fine if a concurrent run created it
+                if index.name not in mysql_index_names(engine, table.name):
+                    raise
+        
+        # Drop the replaced indexes only once their replacements exist
+        for legacy_name in replacements.values():
+            if legacy_name not in existing_indexes:
+                continue
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"DROP INDEX {legacy_name} ON {table.name}"))
+                logging.info("Dropped legacy MySQL index %s", legacy_name)
+            except DBAPIError:
+                # Fine if a concurrent run dropped it
+                if legacy_name in mysql_index_names(engine, table.name):
+                    raise
+
 def init_mongodb_indexes():
-    """Initialize MongoDB indexes for better performance"""
+    """Initialize MongoDB indexes for better performance; safe to run from every worker at startup"""
     try:
-        # Create indexes for better query performance
-        messages_collection.create_index("message_id")
-        messages_collection.create_index("timestamp")
-        messages_collection.create_index("chat_id")
+        # Latest messages in a chat: index-supported sort, no in-memory SORT stage
+        messages_collection.create_index([("chat_id", 1), ("timestamp", -1)])
+        # Messages sent by a user, excluding deleted ones
+        messages_collection.create_index(
+            [("sender_id", 1), ("timestamp", -1)],
+            partialFilterExpression={"is_deleted": False}
+        )
+        try:
+            messages_collection.create_index("message_id", unique=True)
+        except OperationFailure as e:
+            # A legacy non-unique message_id index is still in place; it keeps lookups indexed until migrated
+            logging.warning("Unique message_id index not created (%s); run init_db.py to migrate indexes", e)
         logging.info("MongoDB indexes created successfully")
     except Exception as e:
-        logging.error(f"Error creating MongoDB indexes: {e}")
+        logging.error("Error creating MongoDB indexes: %s", e)
         raise
+
+def migrate_mongodb_indexes():
+    """One-off migration: replace legacy single-key indexes with the ones from init_mongodb_indexes"""
+    # Create the compound indexes first so chat queries never lose index support
+    init_mongodb_indexes()
+    
+    existing_indexes = messages_collection.index_information()
+    legacy = [name for name in ("timestamp_1", "chat_id_1") if name in existing_indexes]
+    message_id_index = existing_indexes.get("message_id_1")
+    if message_id_index is not None and not message_id_index.get("unique"):
+        legacy.append("message_id_1")
+    
+    for index_name in legacy:
+        try:
+            messages_collection.drop_index(index_name)
+            logging.info("Dropped legacy MongoDB index %s", index_name)
+        except OperationFailure as e:
+            # Already dropped by a concurrent run
+            logging.info("Legacy MongoDB index %s not dropped: %s", index_name, e)
+    
+    if "message_id_1" in legacy:
+        # Mongo won't keep a unique and a non-unique index on the same key, so this follows the drop
+        try:
+            messages_collection.create_index("message_id", unique=True)
+        except OperationFailure as e:
+            logging.info("Unique message_id index created concurrently: %s", e)
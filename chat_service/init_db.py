@@ -5,7 +5,7 @@ Run this script to set up the database tables and indexes
 """
 
 import logging
-from database import create_tables, init_mongodb_indexes
+from database import create_tables, migrate_mysql_indexes, migrate_mongodb_indexes
 
 # Configure logging
 logging.basicConfig(
@@ -25,15 +25,20 @@ def main():
         create_tables()
         logger.info("MySQL tables created successfully")
         
-        # Create MongoDB indexes
+        # Add indexes introduced after the tables were created, replacing the ones they supersede
+        logger.info("Migrating MySQL indexes...")
+        migrate_mysql_indexes()
+        logger.info("MySQL indexes migrated successfully")
+        
+        # Create MongoDB indexes, replacing legacy ones from older versions
         logger.info("Creating MongoDB indexes...")
-        init_mongodb_indexes()
+        migrate_mongodb_indexes()
         logger.info("MongoDB indexes created successfully")
         
         logger.info("Database initialization completed successfully!")
         
     except Exception as e:
-        logger.error(f"Database initialization failed: {e}")
+        logger.error("Database initialization failed: %s", e)
         raise
 
 if __name__ == "__main__":
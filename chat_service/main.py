@@ -1,16 +1,22 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import logging
+import sys
+import time
 import uvicorn
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
 from config import settings
-from database import create_tables, init_mongodb_indexes
+from database import create_tables, init_mongodb_indexes, engine, mongo_client
 from routes import users, chats, messages, websocket
+from websocket_manager import manager
+from message_writer import message_writer
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO if not settings.DEBUG else logging.DEBUG,
+    level=settings.LOG_LEVEL,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 
@@ -28,19 +34,26 @@ async def lifespan(app: FastAPI):
         init_mongodb_indexes()
         logger.info("Database initialization completed")
     except Exception as e:
-        logger.error(f"Database initialization failed: {e}")
+        logger.error("Database initialization failed: %s", e)
         raise
     
+    if settings.REDIS_URL:
+        await manager.start_backplane(settings.REDIS_URL)
+    message_writer.start()
+    
     yield
     
     # Shutdown
     logger.info("Shutting down Chat Service...")
+    await message_writer.stop()
+    await manager.stop_backplane()
 
 # Create FastAPI app
 app = FastAPI(
     title="Chat Service API",
     description="A real-time chat service supporting 1:1 and group chats",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -68,28 +81,31 @@ async def root():
         "status": "running"
     }
 
+@lru_cache(maxsize=1)
+def _check_databases(ttl_bucket: int) -> dict:
+    """Ping both databases; cached per one-second bucket to coalesce concurrent probes"""
+    # Test MySQL connection: pool_pre_ping issues the driver's native ping on checkout,
+    # so borrowing a pooled connection is enough and no SQL is sent
+    with engine.connect():
+        pass
+    
+    # Test MongoDB connection
+    mongo_client.admin.command("ping")
+    
+    return {
+        "status": "healthy",
+        "mysql": "connected",
+        "mongodb": "connected",
+        "mysql_pool_idle": engine.pool.checkedin()
+    }
+
 @app.get("/health")
-async def health_check():
+def health_check():
     """Health check endpoint"""
     try:
-        # Test database connections
-        from database import SessionLocal, mongo_db
-        
-        # Test MySQL connection
-        db = SessionLocal()
-        db.execute("SELECT 1")
-        db.close()
-        
-        # Test MongoDB connection
-        mongo_db.command("ping")
-        
-        return {
-            "status": "healthy",
-            "mysql": "connected",
-            "mongodb": "connected"
-        }
+        return _check_databases(int(time.monotonic()))
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error("Health check failed: %s", e)
         raise HTTPException(status_code=503, detail="Service unhealthy")
 
 @app.get("/api/v1/info")
@@ -112,11 +128,23 @@ async def get_api_info():
         }
     }
 
+# uvloop is not available on Windows
+SERVER_LOOP = "asyncio" if sys.platform == "win32" else "uvloop"
+
 if __name__ == "__main__":
+    # uvicorn ignores workers while reloading, so multiple workers take precedence over DEBUG auto-reload
+    reload = settings.DEBUG and settings.WORKERS == 1
+    if settings.DEBUG and not reload:
+        logger.warning("Auto-reload disabled: WORKERS=%s cannot be combined with reload", settings.WORKERS)
+    
     uvicorn.run(
         "main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG,
-        log_level="info" if not settings.DEBUG else "debug"
+        reload=reload,
+        workers=settings.WORKERS,
+        log_level=settings.LOG_LEVEL.lower(),
+        loop=SERVER_LOOP,
+        http="httptools",
+        ws_per_message_deflate=False  # Compressing every frame costs CPU and memory per connection
     )
@@ -0,0 +1,118 @@
+from typing import List, Tuple
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import logging
+from database import SessionLocal
+from services import MessageService
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class MessageWriter:
+    """Coalesces concurrent message writes into batched inserts.
+
+    Callers still wait for their own message to be stored, so broadcasts carry
+    the real database id. Under light load every batch holds a single message;
+    under heavy load, messages that arrive while a batch is being written are
+    stored together in the next one.
+    """
+
+    def __init__(self, max_batch: int):
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        # Set by stop(); submissions fail fast instead of restarting the writer
+        self._stopping = False
+
+    def start(self):
+        """Start the background writer task"""
+        self._stopping = False
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything already queued, then stop the writer"""
+        if self._task is None:
+            return
+        self._stopping = True
+        if not self._task.done():
+            # Sentinel: items queued before it are still written
+            self._queue.put_nowait(None)
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Nothing will read the queue any more; fail whatever is left so no caller waits forever
+        self._fail_pending([])
+        self._task = None
+
+    async def submit(self, chat_id: int, sender_id: int, sender_username: str, content: str) -> dict:
+        """Queue an already validated message for the next batch and wait until it is stored"""
+        if self._stopping:
+            raise RuntimeError("Message writer stopped")
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((chat_id, sender_id, sender_username, content, future))
+        return await future
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                stopping = False
+                while len(batch) < self.max_batch and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                await self._flush(batch)
+                batch = []
+                if stopping:
+                    return
+        except asyncio.CancelledError:
+            # Cancelled from outside (e.g. loop teardown): nobody may be left waiting forever
+            self._fail_pending(batch)
+            raise
+
+    def _fail_pending(self, batch: List[Tuple[int, int, str, str, asyncio.Future]]):
+        """Fail the in-flight batch and everything still queued"""
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                batch.append(item)
+        for *_, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("Message writer stopped"))
+
+    async def _flush(self, batch: List[Tuple[int, int, str, str, asyncio.Future]]):
+        try:
+            results = await run_in_threadpool(self._write, [item[:4] for item in batch])
+        except Exception as e:
+            logger.error("Failed to write batch of %s messages: %s", len(batch), e)
+            results = [e] * len(batch)
+
+        for (*_, future), result in zip(batch, results):
+            # The sender may have disconnected while waiting
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _write(items: List[Tuple[int, int, str, str]]) -> list:
+        db = SessionLocal()
+        try:
+            return MessageService.create_messages(db, items)
+        finally:
+            db.close()
+
+# Global message writer instance
+message_writer = MessageWriter(settings.MESSAGE_WRITE_BATCH_SIZE)
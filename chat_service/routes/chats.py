@@ -1,20 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from typing import List
-import math
-from database import get_db, User
+from datetime import datetime
+from database import get_db, User, chat_participants
 from auth import get_current_active_user
 from schemas import (
     ChatCreate, ChatResponse, ChatUpdate, ChatListResponse,
     ChatParticipantAdd, ChatParticipantRemove, ChatParticipantResponse,
     PaginationParams
 )
-from services import ChatService
+from services import ChatService, MessageService
+from websocket_manager import manager
 
 router = APIRouter(prefix="/chats", tags=["chats"])
 
 @router.post("/", response_model=ChatResponse, status_code=status.HTTP_201_CREATED)
-async def create_chat(
+def create_chat(
     chat_data: ChatCreate,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -27,7 +28,7 @@ async def create_chat(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.get("/", response_model=dict)
-async def get_user_chats(
+def get_user_chats(
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
     current_user = Depends(get_current_active_user),
@@ -35,27 +36,25 @@ async def get_user_chats(
 ):
     """Get all chats for the current user with pagination"""
     pagination = PaginationParams(page=page, limit=limit)
-    chats, total = ChatService.get_user_chats(db, current_user.id, pagination)
+    rows, total = ChatService.get_user_chat_rows(db, current_user.id, pagination)
     
-    # Convert to list response format with additional info
+    # Get last message content for the whole page in one MongoDB round trip
+    last_messages = MessageService.get_last_messages([row.id for row in rows])
+    
+    # Convert to list response format with additional info (trusted DB rows, skip re-validation)
     chat_list = []
-    for chat in chats:
-        # Get last message info (simplified for now)
-        last_message = None
-        last_message_time = None
-        
-        # Get participant count
-        participant_count = len(chat.participants)
+    for row in rows:
+        last_message = last_messages.get(row.id)
         
-        chat_item = ChatListResponse(
-            id=chat.id,
-            name=chat.name,
-            chat_type=chat.chat_type,
-            created_at=chat.created_at,
-            updated_at=chat.updated_at,
-            participant_count=participant_count,
-            last_message=last_message,
-            last_message_time=last_message_time
+        chat_item = ChatListResponse.model_construct(
+            id=row.id,
+            name=row.name,
+            chat_type=row.chat_type,
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+            participant_count=row.participant_count,
+            last_message=last_message["content"] if last_message else None,
+            last_message_time=row.last_message_time
         )
         chat_list.append(chat_item)
     
@@ -64,11 +63,11 @@ async def get_user_chats(
         "total": total,
         "page": page,
         "limit": limit,
-        "pages": math.ceil(total / limit) if total > 0 else 0
+        "pages": (total + limit - 1) // limit
     }
 
 @router.get("/{chat_id}", response_model=ChatResponse)
-async def get_chat(
+def get_chat(
     chat_id: int,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -84,42 +83,29 @@ async def get_chat(
     return chat
 
 @router.put("/{chat_id}", response_model=ChatResponse)
-async def update_chat(
+def update_chat(
     chat_id: int,
     chat_update: ChatUpdate,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Update chat details (group chats only)"""
-    chat = ChatService.get_chat_by_id(db, chat_id, current_user.id)
-    if not chat:
+    # Fetch the chat and the caller's admin flag in one round trip
+    result = ChatService.get_chat_with_admin_flag(db, chat_id, current_user.id)
+    if not result:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Chat not found or you don't have access"
         )
     
+    chat, is_admin = result
     if chat.chat_type != "group":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Can only update group chats"
         )
     
-    # Check if user is admin
-    user_participant = None
-    for participant in chat.participants:
-        if participant.id == current_user.id:
-            user_participant = participant
-            break
-    
-    # Get admin status from association table
-    from database import chat_participants
-    admin_check = db.query(chat_participants).filter(
-        chat_participants.c.chat_id == chat_id,
-        chat_participants.c.user_id == current_user.id,
-        chat_participants.c.is_admin == True
-    ).first()
-    
-    if not admin_check:
+    if not is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only admins can update chat details"
@@ -129,12 +115,13 @@ async def update_chat(
     if chat_update.name is not None:
         chat.name = chat_update.name
     
+    # Set the onupdate timestamp ourselves so the row needs no reload after commit
+    chat.updated_at = datetime.utcnow()
     db.commit()
-    db.refresh(chat)
     return chat
 
 @router.post("/{chat_id}/participants", status_code=status.HTTP_200_OK)
-async def add_participants(
+def add_participants(
     chat_id: int,
     participant_data: ChatParticipantAdd,
     current_user = Depends(get_current_active_user),
@@ -143,12 +130,13 @@ async def add_participants(
     """Add participants to a group chat"""
     try:
         ChatService.add_participants(db, chat_id, participant_data.user_ids, current_user.id)
+        manager.publish_access_change(chat_id, participant_data.user_ids)
         return {"message": "Participants added successfully"}
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.delete("/{chat_id}/participants", status_code=status.HTTP_200_OK)
-async def remove_participant(
+def remove_participant(
     chat_id: int,
     participant_data: ChatParticipantRemove,
     current_user = Depends(get_current_active_user),
@@ -157,12 +145,13 @@ async def remove_participant(
     """Remove a participant from a group chat"""
     try:
         ChatService.remove_participant(db, chat_id, participant_data.user_id, current_user.id)
+        manager.publish_access_change(chat_id, [participant_data.user_id])
         return {"message": "Participant removed successfully"}
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.get("/{chat_id}/participants", response_model=List[ChatParticipantResponse])
-async def get_chat_participants(
+def get_chat_participants(
     chat_id: int,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -175,30 +164,32 @@ async def get_chat_participants(
             detail="Chat not found or you don't have access"
         )
     
-    # Get participant details with admin status
-    from database import chat_participants
+    # Get participant details with admin status in a single JOIN
     participants_query = db.query(
-        chat_participants.c.user_id,
+        User.id,
+        User.username,
+        User.full_name,
         chat_participants.c.joined_at,
         chat_participants.c.is_admin
+    ).join(
+        chat_participants, chat_participants.c.user_id == User.id
     ).filter(chat_participants.c.chat_id == chat_id).all()
     
-    participants = []
-    for participant_data in participants_query:
-        user = db.query(User).filter(User.id == participant_data.user_id).first()
-        if user:
-            participants.append(ChatParticipantResponse(
-                user_id=user.id,
-                username=user.username,
-                full_name=user.full_name,
-                joined_at=participant_data.joined_at,
-                is_admin=participant_data.is_admin
-            ))
+    participants = [
+        ChatParticipantResponse(
+            user_id=row.id,
+            username=row.username,
+            full_name=row.full_name,
+            joined_at=row.joined_at,
+            is_admin=row.is_admin
+        )
+        for row in participants_query
+    ]
     
     return participants
 
 @router.delete("/{chat_id}", status_code=status.HTTP_200_OK)
-async def leave_chat(
+def leave_chat(
     chat_id: int,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -206,6 +197,7 @@ async def leave_chat(
     """Leave a chat"""
     try:
         ChatService.remove_participant(db, chat_id, current_user.id, current_user.id)
+        manager.publish_access_change(chat_id, [current_user.id])
         return {"message": "Left chat successfully"}
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from typing import List
-import math
+from typing import List, Optional
 from database import get_db
 from auth import get_current_active_user
-from schemas import MessageCreate, MessageResponse, MessageUpdate, PaginationParams
+from schemas import MessageCreate, MessageResponse, MessageUpdate
 from services import MessageService
+from websocket_manager import manager, now_iso
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
@@ -17,39 +19,45 @@ async def send_message(
 ):
     """Send a new message to a chat"""
     try:
-        message = MessageService.create_message(db, message_data, current_user.id)
-        return MessageResponse(**message)
+        message = await run_in_threadpool(
+            MessageService.create_message, db, message_data, current_user.id, current_user.username
+        )
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    # Deliver to connected clients on every worker, same as messages sent over the WebSocket
+    await manager.broadcast_to_chat(message_data.chat_id, {
+        "type": "new_message",
+        "chat_id": message_data.chat_id,
+        "message": message,
+        "timestamp": now_iso()
+    })
+    return MessageResponse(**message)
 
 @router.get("/chat/{chat_id}", response_model=dict)
-async def get_chat_messages(
+def get_chat_messages(
     chat_id: int,
-    page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from next_cursor of the previous page"),
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Get messages for a specific chat with pagination"""
+    """Get messages for a specific chat, newest first, with cursor pagination"""
     try:
-        pagination = PaginationParams(page=page, limit=limit)
-        messages, total = MessageService.get_chat_messages(db, chat_id, current_user.id, pagination)
-        
-        # Convert to response format
-        message_responses = [MessageResponse(**msg) for msg in messages]
+        messages, next_cursor = MessageService.get_chat_messages(db, chat_id, current_user.id, limit, cursor)
         
-        return {
-            "items": message_responses,
-            "total": total,
-            "page": page,
+        # orjson encodes the message dataclasses directly (rows come from our own DB, so skip re-validation)
+        return ORJSONResponse({
+            "items": messages,
             "limit": limit,
-            "pages": math.ceil(total / limit) if total > 0 else 0
-        }
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
+        })
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.put("/{message_id}", response_model=MessageResponse)
-async def update_message(
+def update_message(
     message_id: int,
     message_update: MessageUpdate,
     current_user = Depends(get_current_active_user),
@@ -57,7 +65,7 @@ async def update_message(
 ):
     """Update a message (only by the sender)"""
     try:
-        message = MessageService.update_message(db, message_id, message_update.content, current_user.id)
+        message = MessageService.update_message(db, message_id, message_update.content, current_user.id, current_user.username)
         if not message:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -68,7 +76,7 @@ async def update_message(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.delete("/{message_id}", status_code=status.HTTP_200_OK)
-async def delete_message(
+def delete_message(
     message_id: int,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -1,17 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from typing import List
+from datetime import datetime
 from database import get_db, User
-from auth import get_current_active_user, authenticate_user, create_access_token
+from auth import get_current_active_user, authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRES
 from schemas import UserCreate, UserResponse, UserLogin, Token, UserUpdate
 from services import UserService
-from datetime import timedelta
-from config import settings
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
+def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """Register a new user"""
     try:
         user = UserService.create_user(db, user_data)
@@ -20,8 +19,9 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.post("/login", response_model=Token)
-async def login_user(user_credentials: UserLogin, db: Session = Depends(get_db)):
+def login_user(user_credentials: UserLogin, db: Session = Depends(get_db)):
     """Login user and return access token"""
+    # Sync handler: FastAPI runs it in the threadpool, so the bcrypt verify doesn't block the event loop
     user = authenticate_user(db, user_credentials.username, user_credentials.password)
     if not user:
         raise HTTPException(
@@ -30,9 +30,8 @@ async def login_user(user_credentials: UserLogin, db: Session = Depends(get_db))
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username}, expires_delta=ACCESS_TOKEN_EXPIRES
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
@@ -43,7 +42,7 @@ async def get_current_user_info(current_user = Depends(get_current_active_user))
     return current_user
 
 @router.put("/me", response_model=UserResponse)
-async def update_current_user(
+def update_current_user(
     user_update: UserUpdate,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -54,12 +53,14 @@ async def update_current_user(
     
     if user_update.email is not None:
         # Check if email is already taken by another user
-        existing_user = db.query(User).filter(
-            User.email == user_update.email,
-            User.id != current_user.id
-        ).first()
+        email_taken = db.query(
+            db.query(User).filter(
+                User.email == user_update.email,
+                User.id != current_user.id
+            ).exists()
+        ).scalar()
         
-        if existing_user:
+        if email_taken:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
@@ -67,29 +68,31 @@ async def update_current_user(
         
         current_user.email = user_update.email
     
+    # Set the onupdate timestamp ourselves so the row needs no reload after commit
+    current_user.last_seen = datetime.utcnow()
     db.commit()
-    db.refresh(current_user)
     return current_user
 
 @router.get("/search", response_model=List[UserResponse])
-async def search_users(
+def search_users(
     q: str,
-    limit: int = 10,
+    limit: int = Query(10, ge=1, le=50),
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Search users by username or full name"""
-    if len(q.strip()) < 2:
+    """Search users by username prefix or full name words"""
+    query = q.strip()
+    if len(query) < 2:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Search query must be at least 2 characters long"
         )
     
-    users = UserService.search_users(db, q.strip(), min(limit, 50))
+    users = UserService.search_users(db, query, limit)
     return users
 
 @router.get("/{user_id}", response_model=UserResponse)
-async def get_user_by_id(
+def get_user_by_id(
     user_id: int,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
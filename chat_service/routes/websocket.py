@@ -1,136 +1,174 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import json
 import logging
-from datetime import datetime
-from database import get_db
+import orjson
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+from pydantic import ValidationError
+from database import get_db, SessionLocal, User
 from auth import verify_token, get_current_active_user
-from websocket_manager import manager
-from services import MessageService, ChatService
-from schemas import MessageCreate, WebSocketMessage
+from websocket_manager import manager, now_iso
+from message_writer import message_writer
+from services import ChatService, UserService
+from schemas import WebSocketMessage
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-async def get_current_user_ws(token: str, db: Session):
-    """Get current user from WebSocket token"""
-    payload = verify_token(token)
-    if not payload:
-        return None
+# Pre-built frame templates for replies that only vary by timestamp/message
+_PONG_PREFIX = '{"type":"pong","timestamp":"'
+_ERROR_PREFIX = '{"type":"error","message":'
+_TIMESTAMP_INFIX = ',"timestamp":"'
+_FRAME_SUFFIX = '"}'
+
+@lru_cache(maxsize=64)
+def _json_string(value: str) -> str:
+    return orjson.dumps(value).decode()
+
+def _pong_frame() -> str:
+    return _PONG_PREFIX + now_iso() + _FRAME_SUFFIX
+
+def _error_frame(message: str) -> str:
+    return _ERROR_PREFIX + _json_string(message) + _TIMESTAMP_INFIX + now_iso() + _FRAME_SUFFIX
+
+async def _receive_frame(websocket: WebSocket):
+    """Receive a raw frame payload as sent (str for text frames, bytes for binary frames)"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
     
-    username = payload.get("sub")
+    data = message.get("text")
+    if data is None:
+        # Binary clients get binary frames back, skipping the UTF-8 decode on both sides
+        manager.mark_binary(websocket)
+        data = message.get("bytes") or b""
+    return data
+
+def _authorize_ws(token: str, chat_id: int) -> Tuple[Optional[User], bool]:
+    """Resolve the token's user and their access to the chat with a short-lived session.
+    
+    The session is closed before the socket starts receiving, so idle connections
+    hold no pooled MySQL connection or open transaction.
+    """
+    payload = verify_token(token)
+    username = payload.get("sub") if payload else None
     if not username:
-        return None
+        return None, False
     
-    from database import User
-    user = db.query(User).filter(User.username == username).first()
-    return user
+    db = SessionLocal()
+    try:
+        user = UserService.get_user_by_username(db, username)
+        if not user:
+            return None, False
+        return user, ChatService.has_chat_access(db, chat_id, user.id)
+    finally:
+        db.close()
+
+@dataclass(slots=True)
+class _ConnectionContext:
+    """Per-connection state shared by the message handlers"""
+    websocket: WebSocket
+    chat_id: int
+    user: User
+
+async def _handle_message(ws_message: WebSocketMessage, ctx: _ConnectionContext):
+    """Store a new chat message and broadcast it to the chat"""
+    # Content arrives already stripped by the schema
+    if not ws_message.content:
+        return
+    
+    try:
+        # Content was already validated by WebSocketMessage, so pass primitives straight through;
+        # concurrent messages are coalesced into batched inserts
+        message = await message_writer.submit(ctx.chat_id, ctx.user.id, ctx.user.username, ws_message.content)
+        
+        # Broadcast message to all chat participants
+        broadcast_message = {
+            "type": "new_message",
+            "chat_id": ctx.chat_id,
+            "message": message,
+            "timestamp": now_iso()
+        }
+        
+        await manager.broadcast_to_chat(ctx.chat_id, broadcast_message)
+        
+    except ValueError as e:
+        # Send error back to sender
+        manager.enqueue(ctx.websocket, _error_frame(str(e)))
+
+async def _handle_typing(ws_message: WebSocketMessage, ctx: _ConnectionContext):
+    """Relay a typing indicator to the rest of the chat"""
+    is_typing = ws_message.content == "start"
+    await manager.handle_typing_indicator(ctx.user.id, ctx.chat_id, is_typing)
+
+async def _handle_ping(ws_message: WebSocketMessage, ctx: _ConnectionContext):
+    """Answer a ping for connection health"""
+    manager.enqueue(ctx.websocket, _pong_frame())
+
+# Dispatch table for inbound message types
+_HANDLERS = {
+    "message": _handle_message,
+    "typing": _handle_typing,
+    "ping": _handle_ping,
+}
 
 @router.websocket("/ws/{chat_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     chat_id: int,
-    token: str = Query(...),
-    db: Session = Depends(get_db)
+    token: str = Query(...)
 ):
     """WebSocket endpoint for real-time chat"""
-    # Authenticate user
-    user = await get_current_user_ws(token, db)
+    # Authenticate user and verify chat access (cached, so reconnects skip the access query)
+    user, has_access = await run_in_threadpool(_authorize_ws, token, chat_id)
     if not user:
         await websocket.close(code=4001, reason="Authentication failed")
         return
     
-    # Verify user has access to this chat
-    chat = ChatService.get_chat_by_id(db, chat_id, user.id)
-    if not chat:
+    if not has_access:
         await websocket.close(code=4003, reason="Access denied to chat")
         return
     
-    # Connect user to chat
-    await manager.connect(websocket, user.id, chat_id)
+    ctx = _ConnectionContext(websocket, chat_id, user)
     
     try:
+        # Connect user to chat; disconnect below undoes whatever was registered if this fails
+        await manager.connect(websocket, user, chat_id)
+        
         while True:
             # Receive message from client
-            data = await websocket.receive_text()
+            data = await _receive_frame(websocket)
             
             try:
-                message_data = json.loads(data)
-                ws_message = WebSocketMessage(**message_data)
-                
-                if ws_message.type == "message":
-                    # Handle new message
-                    if ws_message.content and ws_message.content.strip():
-                        try:
-                            # Create message in database
-                            message_create = MessageCreate(
-                                chat_id=chat_id,
-                                content=ws_message.content.strip()
-                            )
-                            
-                            message = MessageService.create_message(db, message_create, user.id)
-                            
-                            # Broadcast message to all chat participants
-                            broadcast_message = {
-                                "type": "new_message",
-                                "chat_id": chat_id,
-                                "message": message,
-                                "timestamp": datetime.utcnow().isoformat()
-                            }
-                            
-                            await manager.broadcast_to_chat(chat_id, broadcast_message)
-                            
-                        except ValueError as e:
-                            # Send error back to sender
-                            error_message = {
-                                "type": "error",
-                                "message": str(e),
-                                "timestamp": datetime.utcnow().isoformat()
-                            }
-                            await websocket.send_text(json.dumps(error_message))
-                
-                elif ws_message.type == "typing":
-                    # Handle typing indicator
-                    is_typing = ws_message.content == "start"
-                    await manager.handle_typing_indicator(user.id, chat_id, is_typing)
-                
-                elif ws_message.type == "ping":
-                    # Handle ping/pong for connection health
-                    pong_message = {
-                        "type": "pong",
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
-                    await websocket.send_text(json.dumps(pong_message))
+                # Parse and validate in a single pydantic-core pass
+                ws_message = WebSocketMessage.model_validate_json(data)
                 
+                handler = _HANDLERS.get(ws_message.type)
+                if handler is None:
+                    # Known to the schema but not handled by the server
+                    manager.enqueue(websocket, _error_frame(f"Unknown message type: {ws_message.type}"))
                 else:
-                    # Unknown message type
-                    error_message = {
-                        "type": "error",
-                        "message": f"Unknown message type: {ws_message.type}",
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
-                    await websocket.send_text(json.dumps(error_message))
+                    await handler(ws_message, ctx)
                     
-            except json.JSONDecodeError:
-                error_message = {
-                    "type": "error",
-                    "message": "Invalid JSON format",
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                await websocket.send_text(json.dumps(error_message))
+            except ValidationError as e:
+                is_bad_json = any(error["type"] == "json_invalid" for error in e.errors(include_url=False, include_context=False))
+                manager.enqueue(websocket, _error_frame("Invalid JSON format" if is_bad_json else "Invalid message format"))
                 
-            except Exception as e:
-                logging.error(f"Error processing WebSocket message: {e}")
-                error_message = {
-                    "type": "error",
-                    "message": "Internal server error",
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                await websocket.send_text(json.dumps(error_message))
+            except ValueError:
+                # Bad payloads are answered; anything unexpected ends the connection below
+                manager.enqueue(websocket, _error_frame("Invalid message format"))
                 
     except WebSocketDisconnect:
-        logging.info(f"User {user.id} disconnected from chat {chat_id}")
+        logger.info("User %s disconnected from chat %s", user.id, chat_id)
     except Exception as e:
-        logging.error(f"WebSocket error for user {user.id} in chat {chat_id}: {e}")
+        logger.error("WebSocket error for user %s in chat %s: %s", user.id, chat_id, e)
+        try:
+            await websocket.close(code=1011, reason="Internal server error")
+        except Exception:
+            pass
     finally:
         await manager.disconnect(websocket)
 
@@ -139,36 +177,25 @@ async def get_websocket_stats():
     """Get WebSocket connection statistics"""
     return {
         "online_users": manager.get_online_users_count(),
-        "total_connections": sum(len(chats) for chats in manager.active_connections.values())
+        "total_connections": manager.get_connection_count()
     }
 
 @router.get("/ws/chat/{chat_id}/online")
-async def get_chat_online_users(
+def get_chat_online_users(
     chat_id: int,
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Get online users in a specific chat"""
     # Verify user has access to this chat
-    chat = ChatService.get_chat_by_id(db, chat_id, current_user.id)
-    if not chat:
+    if not ChatService.has_chat_access(db, chat_id, current_user.id):
         raise HTTPException(status_code=404, detail="Chat not found or access denied")
     
-    online_users = manager.get_chat_online_users(chat_id)
-    
-    # Get user details
-    from database import User
-    users = db.query(User).filter(User.id.in_(online_users)).all()
+    # Profiles are captured at connect time, so no user lookup is needed
+    online_users = manager.get_chat_online_briefs(chat_id)
     
     return {
         "chat_id": chat_id,
-        "online_users": [
-            {
-                "id": user.id,
-                "username": user.username,
-                "full_name": user.full_name
-            }
-            for user in users
-        ],
-        "count": len(users)
+        "online_users": online_users,
+        "count": len(online_users)
     }
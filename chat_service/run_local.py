@@ -5,6 +5,7 @@ This script helps you run the chat service locally with minimal setup
 """
 
 import os
+import shutil
 import sys
 import subprocess
 import logging
@@ -47,6 +48,13 @@ def get_venv_python():
     else:
         return Path("venv/bin/python")
 
+def pip_install(python_path, *args):
+    """Install packages with uv when it is on PATH, otherwise with pip"""
+    try:
+        subprocess.check_call(["uv", "pip", "install", "--python", str(python_path), *args])
+    except FileNotFoundError:
+        subprocess.check_call([str(python_path), "-m", "pip", "install", *args])
+
 def install_dependencies():
     """Install required Python packages in virtual environment"""
     logger.info("Installing dependencies in virtual environment...")
@@ -58,12 +66,13 @@ def install_dependencies():
     venv_python = get_venv_python()
     
     try:
-        # Upgrade pip first
-        subprocess.check_call([str(venv_python), "-m", "pip", "install", "--upgrade", "pip"])
+        # uv brings its own resolver, so pip only needs upgrading when we fall back to it
+        if shutil.which("uv") is None:
+            subprocess.check_call([str(venv_python), "-m", "pip", "install", "--upgrade", "pip"])
         
         # Try simple requirements first (latest versions)
         logger.info("Trying to install latest versions of packages...")
-        subprocess.check_call([str(venv_python), "-m", "pip", "install", "-r", "requirements-simple.txt"])
+        pip_install(venv_python, "-r", "requirements-simple.txt")
         logger.info("Dependencies installed successfully")
         return True
     except subprocess.CalledProcessError as e:
@@ -71,14 +80,14 @@ def install_dependencies():
         logger.info("Trying with specific versions...")
         try:
             # Try specific versions
-            subprocess.check_call([str(venv_python), "-m", "pip", "install", "-r", "requirements.txt"])
+            pip_install(venv_python, "-r", "requirements.txt")
             logger.info("Dependencies installed successfully with specific versions")
             return True
         except subprocess.CalledProcessError as e2:
             logger.error(f"Failed to install specific versions: {e2}")
             logger.info("Trying with --break-system-packages flag...")
             try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements-simple.txt", "--break-system-packages"])
+                pip_install(sys.executable, "-r", "requirements-simple.txt", "--break-system-packages")
                 logger.info("Dependencies installed successfully with --break-system-packages")
                 return True
             except subprocess.CalledProcessError as e3:
@@ -169,18 +178,23 @@ def run_server():
         try:
             # Import here to avoid import errors if dependencies aren't installed
             import uvicorn
-            from main import app
+            from main import app, SERVER_LOOP
+            from config import settings
             
             logger.info("Server starting on http://localhost:8000")
             logger.info("API Documentation: http://localhost:8000/docs")
             logger.info("Press Ctrl+C to stop the server")
             
+            # Auto-reload only when DEBUG is enabled in .env
             uvicorn.run(
                 "main:app",
                 host="0.0.0.0",
                 port=8000,
-                reload=True,
-                log_level="info"
+                reload=settings.DEBUG,
+                log_level=settings.LOG_LEVEL.lower(),
+                loop=SERVER_LOOP,
+                http="httptools",
+                ws_per_message_deflate=False
             )
         except ImportError as e:
             logger.error(f"Failed to import required modules: {e}")
@@ -1,8 +1,10 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Literal, Optional, List
 from datetime import datetime
 from config import settings
 
+_MAX_GROUP = settings.MAX_GROUP_MEMBERS
+
 # User Schemas
 class UserBase(BaseModel):
     username: str = Field(..., min_length=3, max_length=50)
@@ -22,8 +24,7 @@ class UserResponse(UserBase):
     created_at: datetime
     last_seen: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserLogin(BaseModel):
     username: str
@@ -39,15 +40,16 @@ class ChatBase(BaseModel):
     chat_type: str = Field(..., pattern="^(direct|group)$")
 
 class ChatCreate(ChatBase):
-    participant_ids: List[int] = Field(..., min_items=1)
+    participant_ids: List[int] = Field(..., min_length=1)
     
-    @validator('participant_ids')
-    def validate_participants(cls, v, values):
-        if values.get('chat_type') == 'group' and len(v) > settings.MAX_GROUP_MEMBERS:
-            raise ValueError(f'Group chat cannot have more than {settings.MAX_GROUP_MEMBERS} members')
-        if values.get('chat_type') == 'direct' and len(v) != 1:
+    @model_validator(mode='after')
+    def validate_participants(self):
+        count = len(self.participant_ids)
+        if self.chat_type == 'group' and count > _MAX_GROUP:
+            raise ValueError(f'Group chat cannot have more than {_MAX_GROUP} members')
+        if self.chat_type == 'direct' and count != 1:
             raise ValueError('Direct chat must have exactly 1 other participant')
-        return v
+        return self
 
 class ChatUpdate(BaseModel):
     name: Optional[str] = Field(None, max_length=100)
@@ -59,8 +61,7 @@ class ChatResponse(ChatBase):
     is_active: bool
     participants: List[UserResponse]
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ChatListResponse(BaseModel):
     id: int
@@ -79,6 +80,8 @@ class MessageBase(BaseModel):
 class MessageCreate(MessageBase):
     chat_id: int
 
+    model_config = ConfigDict(frozen=True, extra='forbid')
+
 class MessageUpdate(BaseModel):
     content: str = Field(..., min_length=1, max_length=settings.MAX_MESSAGE_LENGTH)
 
@@ -92,15 +95,16 @@ class MessageResponse(MessageBase):
     is_edited: bool
     is_deleted: bool
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True, extra='forbid')
 
 # WebSocket Schemas
 class WebSocketMessage(BaseModel):
-    type: str  # 'message', 'typing', 'join', 'leave'
+    type: Literal['message', 'typing', 'ping', 'join', 'leave']
     chat_id: int
-    content: Optional[str] = None
-    timestamp: Optional[datetime] = None
+    content: Optional[str] = Field(None, max_length=settings.MAX_MESSAGE_LENGTH)
+
+    # Strip content inside pydantic-core so handlers get it ready to use
+    model_config = ConfigDict(frozen=True, extra='forbid', str_strip_whitespace=True)
 
 class WebSocketResponse(BaseModel):
     type: str
@@ -113,7 +117,7 @@ class WebSocketResponse(BaseModel):
 
 # Chat Participant Schemas
 class ChatParticipantAdd(BaseModel):
-    user_ids: List[int] = Field(..., min_items=1)
+    user_ids: List[int] = Field(..., min_length=1)
 
 class ChatParticipantRemove(BaseModel):
     user_id: int
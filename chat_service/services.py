@@ -1,13 +1,129 @@
-from typing import List, Optional, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from collections import OrderedDict
+from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+from sqlalchemy.orm import Session, raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import and_, or_, func, select, insert, update, tuple_, union, Row
 from datetime import datetime
+import base64
+import re
+import threading
+import time
 import uuid
-from database import User, Chat, MessageMetadata, chat_participants, messages_collection
+from database import User, Chat, MessageMetadata, chat_participants, messages_collection, mysql_index_names, FULL_NAME_FULLTEXT_INDEX
 from schemas import UserCreate, ChatCreate, MessageCreate, PaginationParams
 from auth import get_password_hash
 from config import settings
 
+@dataclass(slots=True)
+class MessageDTO:
+    """A message as listed in chat history; orjson serializes it without an intermediate dict"""
+    id: int
+    chat_id: int
+    sender_id: int
+    sender_username: str
+    content: str
+    timestamp: datetime
+    message_type: str
+    is_edited: bool
+    is_deleted: bool
+
+# LRU of (user_id, chat_id) pairs known to have chat access; only grants are cached.
+# Participant changes invalidate entries on every worker (over the Redis backplane when
+# configured). The TTL is a backstop for invalidations that never arrive: Redis pub/sub
+# is fire-and-forget, and a check running in an older transaction snapshot can miss a removal.
+_ACCESS_CACHE_SIZE = 10_000
+_ACCESS_CACHE_TTL = 60.0
+_chat_access_cache: "OrderedDict[Tuple[int, int], float]" = OrderedDict()
+# Bumped on every invalidation, so grants computed before it are not stored after it
+_chat_access_generations: Dict[int, int] = {}
+_chat_access_lock = threading.Lock()
+
+def _chat_access_snapshot(chat_ids) -> Dict[int, int]:
+    """Current invalidation generation of each chat; take it before querying access"""
+    with _chat_access_lock:
+        return {chat_id: _chat_access_generations.get(chat_id, 0) for chat_id in chat_ids}
+
+def _cached_chat_access(user_id: int, chat_id: int) -> bool:
+    """Check the access cache without touching the database"""
+    key = (user_id, chat_id)
+    with _chat_access_lock:
+        expires_at = _chat_access_cache.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _chat_access_cache[key]
+            return False
+        _chat_access_cache.move_to_end(key)
+        return True
+
+def _remember_chat_access(pairs, snapshot: Dict[int, int]):
+    """Cache (user_id, chat_id) pairs confirmed to have access, unless their chat was invalidated since the snapshot"""
+    expires_at = time.monotonic() + _ACCESS_CACHE_TTL
+    with _chat_access_lock:
+        for key in pairs:
+            if _chat_access_generations.get(key[1], 0) != snapshot[key[1]]:
+                continue
+            _chat_access_cache[key] = expires_at
+            _chat_access_cache.move_to_end(key)
+        while len(_chat_access_cache) > _ACCESS_CACHE_SIZE:
+            _chat_access_cache.popitem(last=False)
+
+def invalidate_chat_access(chat_id: int, user_ids: List[int]):
+    """Drop cached access grants after participants change"""
+    with _chat_access_lock:
+        _chat_access_generations[chat_id] = _chat_access_generations.get(chat_id, 0) + 1
+        for user_id in user_ids:
+            _chat_access_cache.pop((user_id, chat_id), None)
+
+# Mongo inserts run here so they overlap with the MySQL statements of the same request
+_mongo_writes = ThreadPoolExecutor(max_workers=settings.MONGODB_WRITE_THREADS, thread_name_prefix="mongo-write")
+
+def _finish_mongo_write(db: Session, pending: Future):
+    """Wait for a Mongo write started alongside MySQL work; roll MySQL back if it failed"""
+    try:
+        pending.result()
+    except Exception:
+        db.rollback()
+        raise
+
+# Whether users.full_name has its FULLTEXT index: [present, last checked (monotonic)].
+# Databases created before it exist without it until init_db.py is rerun, so a missing
+# index is rechecked now and then and a present one is remembered for good.
+_FULLTEXT_RECHECK_SECONDS = 60.0
+_full_name_fulltext = [False, float("-inf")]
+
+def _has_full_name_fulltext(db: Session) -> bool:
+    """Whether full-name search can use MATCH ... AGAINST (MySQL rejects it without the index)"""
+    if not _full_name_fulltext[0]:
+        now = time.monotonic()
+        if now - _full_name_fulltext[1] >= _FULLTEXT_RECHECK_SECONDS:
+            _full_name_fulltext[1] = now
+            bind = db.get_bind()
+            _full_name_fulltext[0] = (
+                bind.dialect.name == "mysql"
+                and FULL_NAME_FULLTEXT_INDEX in mysql_index_names(bind, User.__tablename__)
+            )
+    return _full_name_fulltext[0]
+
+def _fulltext_terms(query: str) -> str:
+    """Boolean-mode FULLTEXT query requiring a word starting with each search word"""
+    return " ".join(f"+{word}*" for word in re.findall(r"\w+", query))
+
+def _encode_cursor(timestamp: datetime, message_id: int) -> str:
+    """Opaque pagination cursor for the (timestamp, id) position of a message"""
+    raw = f"{timestamp.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
 class UserService:
     @staticmethod
     def create_user(db: Session, user_data: UserCreate) -> User:
@@ -24,16 +140,19 @@ class UserService:
                 raise ValueError("Email already exists")
         
         hashed_password = get_password_hash(user_data.password)
+        now = datetime.utcnow()
         db_user = User(
             username=user_data.username,
             email=user_data.email,
             full_name=user_data.full_name,
-            hashed_password=hashed_password
+            hashed_password=hashed_password,
+            created_at=now,
+            last_seen=now
         )
         
+        # Timestamps are set here rather than by the database, so the new row needs no reload
         db.add(db_user)
         db.commit()
-        db.refresh(db_user)
         return db_user
     
     @staticmethod
@@ -48,13 +167,25 @@ class UserService:
     
     @staticmethod
     def search_users(db: Session, query: str, limit: int = 10) -> List[User]:
-        """Search users by username or full name"""
-        return db.query(User).filter(
-            or_(
-                User.username.ilike(f"%{query}%"),
-                User.full_name.ilike(f"%{query}%")
-            )
-        ).filter(User.is_active == True).limit(limit).all()
+        """Search users by username prefix or by words in their full name"""
+        # Prefix LIKE 'q%' can use the username index; '%q%' forces a full scan
+        pattern = query.replace("/", "//").replace("%", "/%").replace("_", "/_") + "%"
+        matches = select(User.id).where(User.username.like(pattern, escape="/"))
+        
+        # UNION instead of OR so each branch keeps its own index
+        if _has_full_name_fulltext(db):
+            # Any word of the full name ("smi" finds "John Smith") via the FULLTEXT index
+            terms = _fulltext_terms(query)
+            if terms:
+                matches = union(matches, select(User.id).where(User.full_name.match(terms)))
+        else:
+            # FULLTEXT index not migrated yet (see init_db.py): match the start of the full name
+            matches = union(matches, select(User.id).where(User.full_name.like(pattern, escape="/")))
+        
+        matches = matches.subquery()
+        return db.query(User).join(matches, matches.c.id == User.id).filter(
+            User.is_active == True
+        ).limit(limit).all()
 
 class ChatService:
     @staticmethod
@@ -69,54 +200,81 @@ class ChatService:
         
         # For direct chats, check if chat already exists
         if chat_data.chat_type == "direct":
-            existing_chat = db.query(Chat).join(chat_participants).filter(
+            # Two seeks on the (user_id, chat_id) primary key instead of scanning every direct chat
+            first_member = chat_participants.alias("first_member")
+            second_member = chat_participants.alias("second_member")
+            existing_chat = db.query(Chat).options(selectinload(Chat.participants)).join(
+                first_member, first_member.c.chat_id == Chat.id
+            ).join(
+                second_member, second_member.c.chat_id == Chat.id
+            ).filter(
                 Chat.chat_type == "direct",
-                Chat.is_active == True
-            ).group_by(Chat.id).having(
-                func.count(chat_participants.c.user_id) == 2
-            ).all()
+                Chat.is_active == True,
+                first_member.c.user_id == creator_id,
+                second_member.c.user_id == chat_data.participant_ids[0]
+            ).first()
             
-            for chat in existing_chat:
-                chat_participant_ids = [p.id for p in chat.participants]
-                if set(chat_participant_ids) == set(participant_ids):
-                    return chat
+            if existing_chat:
+                return existing_chat
         
         # Create new chat
+        now = datetime.utcnow()
         db_chat = Chat(
             name=chat_data.name,
-            chat_type=chat_data.chat_type
+            chat_type=chat_data.chat_type,
+            created_at=now,
+            updated_at=now
         )
         
         db.add(db_chat)
         db.flush()  # Get the chat ID
         
-        # Add participants
-        for participant in participants:
-            is_admin = participant.id == creator_id
-            db.execute(
-                chat_participants.insert().values(
-                    user_id=participant.id,
-                    chat_id=db_chat.id,
-                    is_admin=is_admin
-                )
-            )
+        # Add all participants in one executemany
+        db.execute(chat_participants.insert(), [
+            {"user_id": participant.id, "chat_id": db_chat.id, "is_admin": participant.id == creator_id}
+            for participant in participants
+        ])
         
         db.commit()
-        db.refresh(db_chat)
+        
+        # The response lists participants; reuse the users validated above instead of lazy-loading them
+        set_committed_value(db_chat, "participants", participants)
         return db_chat
     
     @staticmethod
-    def get_user_chats(db: Session, user_id: int, pagination: PaginationParams) -> Tuple[List[Chat], int]:
-        """Get all chats for a user with pagination"""
-        query = db.query(Chat).join(chat_participants).filter(
+    def get_user_chat_rows(db: Session, user_id: int, pagination: PaginationParams) -> Tuple[List[Row], int]:
+        """Get all chats for a user with pagination as plain rows, with participant count and last message time"""
+        members = chat_participants.alias("members")
+        participant_count = select(func.count(members.c.user_id)).where(
+            members.c.chat_id == Chat.id
+        ).correlate(Chat).scalar_subquery()
+        last_message_time = select(func.max(MessageMetadata.timestamp)).where(
+            MessageMetadata.chat_id == Chat.id,
+            MessageMetadata.is_deleted == False
+        ).correlate(Chat).scalar_subquery()
+        
+        # Column projection: skips identity-map and relationship bookkeeping of full Chat entities
+        query = db.query(
+            Chat.id,
+            Chat.name,
+            Chat.chat_type,
+            Chat.created_at,
+            Chat.updated_at,
+            participant_count.label("participant_count"),
+            last_message_time.label("last_message_time")
+        ).join(chat_participants).filter(
             chat_participants.c.user_id == user_id,
             Chat.is_active == True
         ).order_by(Chat.updated_at.desc())
         
-        total = query.count()
-        chats = query.offset((pagination.page - 1) * pagination.limit).limit(pagination.limit).all()
+        # Bare count: no ORDER BY or per-row subqueries, only the is_active check on Chat
+        total = db.query(func.count(chat_participants.c.chat_id)).join(Chat).filter(
+            chat_participants.c.user_id == user_id,
+            Chat.is_active == True
+        ).scalar()
+        rows = query.offset((pagination.page - 1) * pagination.limit).limit(pagination.limit).all()
         
-        return chats, total
+        return rows, total
     
     @staticmethod
     def get_chat_by_id(db: Session, chat_id: int, user_id: int) -> Optional[Chat]:
@@ -127,54 +285,89 @@ class ChatService:
             Chat.is_active == True
         ).first()
     
+    @staticmethod
+    def has_chat_access(db: Session, chat_id: int, user_id: int) -> bool:
+        """Check if user is a participant of an active chat, using the in-process access cache"""
+        if _cached_chat_access(user_id, chat_id):
+            return True
+        
+        snapshot = _chat_access_snapshot([chat_id])
+        has_access = db.query(
+            db.query(chat_participants).join(Chat).filter(
+                chat_participants.c.chat_id == chat_id,
+                chat_participants.c.user_id == user_id,
+                Chat.is_active == True
+            ).exists()
+        ).scalar()
+        
+        if has_access:
+            _remember_chat_access([(user_id, chat_id)], snapshot)
+        return bool(has_access)
+    
+    @staticmethod
+    def get_chat_with_admin_flag(db: Session, chat_id: int, user_id: int) -> Optional[Tuple[Chat, bool]]:
+        """Get chat by ID together with the user's admin flag if user is a participant"""
+        return db.query(Chat, chat_participants.c.is_admin).join(chat_participants).filter(
+            Chat.id == chat_id,
+            chat_participants.c.user_id == user_id,
+            Chat.is_active == True
+        ).first()
+    
     @staticmethod
     def add_participants(db: Session, chat_id: int, user_ids: List[int], admin_id: int) -> bool:
         """Add participants to a group chat"""
-        # Check if user is admin
-        admin_check = db.query(chat_participants).filter(
-            chat_participants.c.chat_id == chat_id,
-            chat_participants.c.user_id == admin_id,
-            chat_participants.c.is_admin == True
-        ).first()
+        # Reject oversized requests before touching the database
+        if len(user_ids) > settings.MAX_GROUP_MEMBERS:
+            raise ValueError(f"Cannot exceed {settings.MAX_GROUP_MEMBERS} members in group chat")
         
-        if not admin_check:
+        # Lock the chat row so concurrent adds to this chat serialize on the size check,
+        # reading the admin flag and current member count in the same statement
+        member_count = select(func.count()).select_from(chat_participants).where(
+            chat_participants.c.chat_id == Chat.id
+        ).correlate(Chat).scalar_subquery()
+        chat_row = db.query(
+            Chat.chat_type, chat_participants.c.is_admin, member_count.label("member_count")
+        ).outerjoin(
+            chat_participants,
+            and_(chat_participants.c.chat_id == Chat.id, chat_participants.c.user_id == admin_id)
+        ).filter(Chat.id == chat_id).with_for_update().first()
+        
+        if not chat_row or not chat_row.is_admin:
+            db.rollback()
             raise ValueError("Only admins can add participants")
         
-        # Get chat and validate it's a group chat
-        chat = db.query(Chat).filter(Chat.id == chat_id).first()
-        if not chat or chat.chat_type != "group":
+        if chat_row.chat_type != "group":
+            db.rollback()
             raise ValueError("Can only add participants to group chats")
         
-        # Check current participant count
-        current_count = db.query(chat_participants).filter(
-            chat_participants.c.chat_id == chat_id
-        ).count()
-        
-        if current_count + len(user_ids) > settings.MAX_GROUP_MEMBERS:
+        # Resolve existing users and current members with one query each, then diff in Python
+        requested_ids = list(dict.fromkeys(user_ids))
+        known_ids = set(db.execute(
+            select(User.id).where(User.id.in_(requested_ids), User.is_active == True)
+        ).scalars())
+        member_ids = set(db.execute(
+            select(chat_participants.c.user_id).where(
+                chat_participants.c.chat_id == chat_id,
+                chat_participants.c.user_id.in_(requested_ids)
+            )
+        ).scalars())
+        new_rows = [
+            {"user_id": user_id, "chat_id": chat_id, "is_admin": False}
+            for user_id in requested_ids
+            if user_id in known_ids and user_id not in member_ids
+        ]
+        
+        # Only users who actually join count towards the limit
+        if chat_row.member_count + len(new_rows) > settings.MAX_GROUP_MEMBERS:
+            db.rollback()
             raise ValueError(f"Cannot exceed {settings.MAX_GROUP_MEMBERS} members in group chat")
         
-        # Add new participants
-        for user_id in user_ids:
-            # Check if user exists and is not already in chat
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                continue
-            
-            existing = db.query(chat_participants).filter(
-                chat_participants.c.chat_id == chat_id,
-                chat_participants.c.user_id == user_id
-            ).first()
-            
-            if not existing:
-                db.execute(
-                    chat_participants.insert().values(
-                        user_id=user_id,
-                        chat_id=chat_id,
-                        is_admin=False
-                    )
-                )
+        # Insert all new participants in one executemany (a single multi-row INSERT)
+        if new_rows:
+            db.execute(chat_participants.insert(), new_rows)
         
         db.commit()
+        invalidate_chat_access(chat_id, [row["user_id"] for row in new_rows])
         return True
     
     @staticmethod
@@ -202,19 +395,15 @@ class ChatService:
         )
         
         db.commit()
+        invalidate_chat_access(chat_id, [user_id])
         return True
 
 class MessageService:
     @staticmethod
-    def create_message(db: Session, message_data: MessageCreate, sender_id: int) -> dict:
+    def create_message(db: Session, message_data: MessageCreate, sender_id: int, sender_username: str) -> dict:
         """Create a new message"""
         # Verify user is participant in chat
-        participant_check = db.query(chat_participants).filter(
-            chat_participants.c.chat_id == message_data.chat_id,
-            chat_participants.c.user_id == sender_id
-        ).first()
-        
-        if not participant_check:
+        if not ChatService.has_chat_access(db, message_data.chat_id, sender_id):
             raise ValueError("User is not a participant in this chat")
         
         # Generate unique message ID
@@ -227,37 +416,34 @@ class MessageService:
             "content": message_data.content,
             "timestamp": timestamp,
             "chat_id": message_data.chat_id,
-            "sender_id": sender_id
+            "sender_id": sender_id,
+            "is_deleted": False
         }
         
-        messages_collection.insert_one(mongo_message)
+        mongo_write = _mongo_writes.submit(messages_collection.insert_one, mongo_message)
         
-        # Store message metadata in MySQL
-        db_message = MessageMetadata(
+        # Store message metadata in MySQL; the new id comes back with the insert (lastrowid)
+        result = db.execute(insert(MessageMetadata).values(
             chat_id=message_data.chat_id,
             sender_id=sender_id,
             message_id=message_id,
-            timestamp=timestamp
-        )
+            timestamp=timestamp,
+            message_type="text",
+            is_edited=False,
+            is_deleted=False
+        ))
         
-        db.add(db_message)
-        
-        # Update chat's updated_at timestamp
-        chat = db.query(Chat).filter(Chat.id == message_data.chat_id).first()
-        if chat:
-            chat.updated_at = timestamp
+        # Update chat's updated_at timestamp without loading the chat
+        db.execute(update(Chat).where(Chat.id == message_data.chat_id).values(updated_at=timestamp))
         
+        _finish_mongo_write(db, mongo_write)
         db.commit()
-        db.refresh(db_message)
-        
-        # Get sender info
-        sender = db.query(User).filter(User.id == sender_id).first()
         
         return {
-            "id": db_message.id,
+            "id": result.inserted_primary_key[0],
             "chat_id": message_data.chat_id,
             "sender_id": sender_id,
-            "sender_username": sender.username,
+            "sender_username": sender_username,
             "content": message_data.content,
             "timestamp": timestamp,
             "message_type": "text",
@@ -266,106 +452,249 @@ class MessageService:
         }
     
     @staticmethod
-    def get_chat_messages(db: Session, chat_id: int, user_id: int, pagination: PaginationParams) -> Tuple[List[dict], int]:
-        """Get messages for a chat with pagination"""
-        # Verify user is participant
-        participant_check = db.query(chat_participants).filter(
-            chat_participants.c.chat_id == chat_id,
-            chat_participants.c.user_id == user_id
-        ).first()
+    def create_messages(db: Session, items: List[Tuple[int, int, str, str]]) -> List[Union[dict, ValueError]]:
+        """Create a batch of (chat_id, sender_id, sender_username, content) messages with one write per table.
+        
+        Returns one entry per item: the created message, or a ValueError if the sender
+        is not a participant of the chat.
+        """
+        # Verify senders missing from the access cache in one query
+        pairs = {(sender_id, chat_id) for chat_id, sender_id, _, _ in items}
+        allowed = {pair for pair in pairs if _cached_chat_access(*pair)}
+        unchecked = pairs - allowed
+        if unchecked:
+            snapshot = _chat_access_snapshot({chat_id for _, chat_id in unchecked})
+            granted = set(db.execute(
+                select(chat_participants.c.user_id, chat_participants.c.chat_id).join(Chat).where(
+                    tuple_(chat_participants.c.user_id, chat_participants.c.chat_id).in_(unchecked),
+                    Chat.is_active == True
+                )
+            ).all())
+            _remember_chat_access(granted, snapshot)
+            allowed |= granted
+        
+        results: List[Union[dict, ValueError]] = []
+        created: List[Tuple[dict, str]] = []
+        mongo_messages = []
+        metadata_rows = []
+        chat_times: Dict[int, datetime] = {}
+        for chat_id, sender_id, sender_username, content in items:
+            if (sender_id, chat_id) not in allowed:
+                results.append(ValueError("User is not a participant in this chat"))
+                continue
+            
+            message_id = str(uuid.uuid4())
+            timestamp = datetime.utcnow()
+            mongo_messages.append({
+                "message_id": message_id,
+                "content": content,
+                "timestamp": timestamp,
+                "chat_id": chat_id,
+                "sender_id": sender_id,
+                "is_deleted": False
+            })
+            metadata_rows.append({
+                "chat_id": chat_id,
+                "sender_id": sender_id,
+                "message_id": message_id,
+                "timestamp": timestamp,
+                "message_type": "text",
+                "is_edited": False,
+                "is_deleted": False
+            })
+            chat_times[chat_id] = timestamp
+            message = {
+                "id": None,
+                "chat_id": chat_id,
+                "sender_id": sender_id,
+                "sender_username": sender_username,
+                "content": content,
+                "timestamp": timestamp,
+                "message_type": "text",
+                "is_edited": False,
+                "is_deleted": False
+            }
+            results.append(message)
+            created.append((message, message_id))
+        
+        if not created:
+            return results
+        
+        # Store message content in MongoDB
+        mongo_write = _mongo_writes.submit(messages_collection.insert_many, mongo_messages, ordered=False)
+        
+        # Store message metadata in MySQL as one executemany
+        db.execute(insert(MessageMetadata), metadata_rows)
+        for chat_id, timestamp in chat_times.items():
+            db.execute(update(Chat).where(Chat.id == chat_id).values(updated_at=timestamp))
         
-        if not participant_check:
+        # Read back the generated ids
+        ids = dict(db.execute(
+            select(MessageMetadata.message_id, MessageMetadata.id).where(
+                MessageMetadata.message_id.in_([message_id for _, message_id in created])
+            )
+        ).all())
+        
+        _finish_mongo_write(db, mongo_write)
+        db.commit()
+        
+        for message, message_id in created:
+            message["id"] = ids[message_id]
+        return results
+    
+    @staticmethod
+    def get_chat_messages(db: Session, chat_id: int, user_id: int, limit: int, cursor: Optional[str] = None) -> Tuple[List[MessageDTO], Optional[str]]:
+        """Get a page of messages for a chat, newest first, using keyset pagination.
+        
+        Returns the messages and the cursor for the next (older) page, or None on the last page.
+        """
+        # Verify user is participant
+        if not ChatService.has_chat_access(db, chat_id, user_id):
             raise ValueError("User is not a participant in this chat")
         
-        # Get message metadata from MySQL
-        query = db.query(MessageMetadata).filter(
+        # Get message metadata from MySQL with sender names joined in; lazy loads are disallowed
+        query = db.query(MessageMetadata, User.username).outerjoin(
+            User, User.id == MessageMetadata.sender_id
+        ).options(raiseload("*")).filter(
             MessageMetadata.chat_id == chat_id,
             MessageMetadata.is_deleted == False
-        ).order_by(MessageMetadata.timestamp.desc())
-        
-        total = query.count()
-        message_metadata = query.offset((pagination.page - 1) * pagination.limit).limit(pagination.limit).all()
+        )
+        if cursor is not None:
+            # Seek past already-seen messages instead of scanning and discarding OFFSET rows
+            cursor_ts, cursor_id = _decode_cursor(cursor)
+            query = query.filter(
+                tuple_(MessageMetadata.timestamp, MessageMetadata.id) < tuple_(cursor_ts, cursor_id)
+            )
         
-        # Get message content from MongoDB
-        message_ids = [msg.message_id for msg in message_metadata]
-        mongo_messages = list(messages_collection.find({"message_id": {"$in": message_ids}}))
+        # Fetch one extra row to learn whether an older page exists, without counting
+        message_metadata = query.order_by(
+            MessageMetadata.timestamp.desc(), MessageMetadata.id.desc()
+        ).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(message_metadata) > limit:
+            message_metadata = message_metadata[:limit]
+            last = message_metadata[-1].MessageMetadata
+            next_cursor = _encode_cursor(last.timestamp, last.id)
+        
+        # Get message content from MongoDB, fetching only the fields used below
+        message_ids = [row.MessageMetadata.message_id for row in message_metadata]
+        mongo_messages = messages_collection.find(
+            {"message_id": {"$in": message_ids}},
+            {"_id": 0, "message_id": 1, "content": 1}
+        )
         
         # Create message dict for quick lookup
         mongo_dict = {msg["message_id"]: msg for msg in mongo_messages}
         
         # Combine metadata and content
         messages = []
-        for metadata in message_metadata:
+        for metadata, sender_username in message_metadata:
             mongo_msg = mongo_dict.get(metadata.message_id, {})
-            sender = db.query(User).filter(User.id == metadata.sender_id).first()
             
-            messages.append({
-                "id": metadata.id,
-                "chat_id": metadata.chat_id,
-                "sender_id": metadata.sender_id,
-                "sender_username": sender.username if sender else "Unknown",
-                "content": mongo_msg.get("content", ""),
-                "timestamp": metadata.timestamp,
-                "message_type": metadata.message_type,
-                "is_edited": metadata.is_edited,
-                "is_deleted": metadata.is_deleted
-            })
-        
-        return messages, total
+            messages.append(MessageDTO(
+                id=metadata.id,
+                chat_id=metadata.chat_id,
+                sender_id=metadata.sender_id,
+                sender_username=sender_username or "Unknown",
+                content=mongo_msg.get("content", ""),
+                timestamp=metadata.timestamp,
+                message_type=metadata.message_type,
+                is_edited=metadata.is_edited,
+                is_deleted=metadata.is_deleted
+            ))
+        
+        return messages, next_cursor
+    
+    @staticmethod
+    def get_last_messages(chat_ids: List[int]) -> Dict[int, dict]:
+        """Get the latest message of each chat in a single aggregation, keyed by chat ID"""
+        if not chat_ids:
+            return {}
+        
+        pipeline = [
+            {"$match": {"chat_id": {"$in": chat_ids}, "is_deleted": {"$ne": True}}},
+            {"$sort": {"chat_id": 1, "timestamp": -1}},
+            {"$group": {
+                "_id": "$chat_id",
+                "content": {"$first": "$content"},
+                "timestamp": {"$first": "$timestamp"}
+            }}
+        ]
+        return {doc["_id"]: doc for doc in messages_collection.aggregate(pipeline)}
     
     @staticmethod
-    def update_message(db: Session, message_id: int, new_content: str, user_id: int) -> Optional[dict]:
+    def update_message(db: Session, message_id: int, new_content: str, user_id: int, sender_username: str) -> Optional[dict]:
         """Update a message"""
-        # Get message metadata
-        message = db.query(MessageMetadata).filter(
-            MessageMetadata.id == message_id,
-            MessageMetadata.sender_id == user_id,
-            MessageMetadata.is_deleted == False
-        ).first()
-        
-        if not message:
-            raise ValueError("Message not found or you don't have permission to edit it")
-        
-        # Update content in MongoDB
-        messages_collection.update_one(
-            {"message_id": message.message_id},
-            {"$set": {"content": new_content, "edited_at": datetime.utcnow()}}
+        # The permission check is the UPDATE's own WHERE clause, so no locking read is taken
+        result = db.execute(
+            update(MessageMetadata).where(
+                MessageMetadata.id == message_id,
+                MessageMetadata.sender_id == user_id,
+                MessageMetadata.is_deleted == False
+            ).values(is_edited=True)
         )
+        if result.rowcount == 0:
+            raise ValueError("Message not found or you don't have permission to edit it")
         
-        # Update metadata in MySQL
-        message.is_edited = True
+        # Plain read of the columns needed below (no ORM entity, no lock)
+        message = db.execute(
+            select(
+                MessageMetadata.message_id, MessageMetadata.chat_id,
+                MessageMetadata.timestamp, MessageMetadata.message_type
+            ).where(MessageMetadata.id == message_id)
+        ).one()
+        
+        # Update content in MongoDB. Its key is only known after the ownership UPDATE, so there
+        # is no MySQL work left to overlap with and the write runs inline
+        try:
+            messages_collection.update_one(
+                {"message_id": message.message_id},
+                {"$set": {"content": new_content, "edited_at": datetime.utcnow()}}
+            )
+        except Exception:
+            db.rollback()
+            raise
         db.commit()
         
-        # Get updated message
-        mongo_msg = messages_collection.find_one({"message_id": message.message_id})
-        sender = db.query(User).filter(User.id == message.sender_id).first()
-        
+        # Everything is known from the row read above and the new content; no read-back needed
         return {
-            "id": message.id,
+            "id": message_id,
             "chat_id": message.chat_id,
-            "sender_id": message.sender_id,
-            "sender_username": sender.username,
-            "content": mongo_msg["content"],
+            "sender_id": user_id,
+            "sender_username": sender_username,
+            "content": new_content,
             "timestamp": message.timestamp,
             "message_type": message.message_type,
-            "is_edited": message.is_edited,
-            "is_deleted": message.is_deleted
+            "is_edited": True,
+            "is_deleted": False
         }
     
     @staticmethod
     def delete_message(db: Session, message_id: int, user_id: int) -> bool:
         """Delete a message (soft delete)"""
-        message = db.query(MessageMetadata).filter(
-            MessageMetadata.id == message_id,
-            MessageMetadata.sender_id == user_id,
-            MessageMetadata.is_deleted == False
-        ).first()
-        
-        if not message:
+        # Soft delete in MySQL with a single-row UPDATE that also checks ownership
+        result = db.execute(
+            update(MessageMetadata).where(
+                MessageMetadata.id == message_id,
+                MessageMetadata.sender_id == user_id,
+                MessageMetadata.is_deleted == False
+            ).values(is_deleted=True)
+        )
+        if result.rowcount == 0:
             raise ValueError("Message not found or you don't have permission to delete it")
         
-        # Soft delete in MySQL
-        message.is_deleted = True
+        # Only the Mongo key is needed; read it without a lock
+        mongo_key = db.execute(
+            select(MessageMetadata.message_id).where(MessageMetadata.id == message_id)
+        ).scalar_one()
+        
+        # Mark deleted in MongoDB so it is skipped by last-message lookups; inline, as in update_message
+        try:
+            messages_collection.update_one({"message_id": mongo_key}, {"$set": {"is_deleted": True}})
+        except Exception:
+            db.rollback()
+            raise
         db.commit()
         
         return True
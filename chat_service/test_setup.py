@@ -88,6 +88,12 @@ try:
 except ImportError as e:
     print(f"❌ Passlib: {e}")
 
+try:
+    import orjson
+    print(f"✅ orjson: {orjson.__version__}")
+except ImportError as e:
+    print(f"❌ orjson: {e}")
+
 print("\\n🎉 All core dependencies are working!")
 '''
     
@@ -1,47 +1,208 @@
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Union
 from fastapi import WebSocket
-import json
+import asyncio
 import logging
+import orjson
+import time
+from dataclasses import dataclass
 from datetime import datetime
+from config import settings
+from services import invalidate_chat_access
+
+logger = logging.getLogger(__name__)
+
+# Close code sent to clients that can't keep up with their send queue
+SLOW_CLIENT_CLOSE_CODE = 4008
+
+# Redis channel prefix for chat broadcasts shared between workers
+CHAT_CHANNEL_PREFIX = "chat:"
+# Redis channel telling every worker to drop cached chat access grants
+ACCESS_CHANNEL = "chat-access"
+
+# Stored datetimes are naive UTC (datetime.utcnow); mark them as such on the wire
+_FRAME_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+# Last formatted timestamp: [unix time, ISO string]
+_ts_cache = [0.0, ""]
+
+def now_iso() -> str:
+    """Current UTC time as a Z-suffixed ISO string, reformatted at most once per millisecond"""
+    now = time.time()
+    if now - _ts_cache[0] >= 0.001:
+        _ts_cache[0] = now
+        _ts_cache[1] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + ".%03dZ" % (now % 1 * 1000)
+    return _ts_cache[1]
+
+@dataclass(frozen=True, slots=True)
+class UserBrief:
+    """Public profile fields of a connected user"""
+    id: int
+    username: str
+    full_name: Optional[str]
+
+def encode_frame(message: dict) -> bytes:
+    """Serialize a message to UTF-8 JSON; naive datetimes are UTC and encode natively with a Z suffix"""
+    return orjson.dumps(message, default=str, option=_FRAME_OPTIONS)
+
+# Presence and typing events carry no user content, so they are formatted without a JSON encoder
+_PRESENCE_TEMPLATE = b'{"type":"%s","user_id":%d,"chat_id":%d,"timestamp":"%s"}'
+
+def presence_frame(event_type: bytes, user_id: int, chat_id: int) -> bytes:
+    """Build a user_joined/user_left/typing_* frame from the pre-built template"""
+    return _PRESENCE_TEMPLATE % (event_type, user_id, chat_id, now_iso().encode())
 
 class ConnectionManager:
     def __init__(self):
-        # Store active connections: {user_id: {chat_id: [websockets]}}
-        self.active_connections: Dict[int, Dict[int, List[WebSocket]]] = {}
+        # Store active connections: {user_id: {chat_id: {websockets}}}
+        self.active_connections: Dict[int, Dict[int, Set[WebSocket]]] = {}
         # Store user to websocket mapping for quick lookup
-        self.user_websockets: Dict[int, List[WebSocket]] = {}
+        self.user_websockets: Dict[int, Set[WebSocket]] = {}
         # Store websocket to user mapping
         self.websocket_users: Dict[WebSocket, int] = {}
+        # Profile of each online user, captured at connect time
+        self.user_briefs: Dict[int, UserBrief] = {}
+        # Chat index for fan-out: {chat_id: {user_id: {websockets}}}
+        self.chat_connections: Dict[int, Dict[int, Set[WebSocket]]] = {}
+        # Store websocket to chat mapping
+        self.websocket_chats: Dict[WebSocket, int] = {}
         # Store typing indicators: {chat_id: {user_id: timestamp}}
         self.typing_users: Dict[int, Dict[int, datetime]] = {}
+        # Reverse typing index: {user_id: {chat_id, ...}}
+        self.user_typing_chats: Dict[int, Set[int]] = {}
+        # Websockets whose client sends binary frames; they get binary frames back
+        self.binary_sockets: Set[WebSocket] = set()
+        # Outbound frame queue and its writer task per websocket
+        self.send_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.writer_tasks: Dict[WebSocket, asyncio.Task] = {}
+        # Keep references to fire-and-forget close tasks until they finish
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Optional Redis pub/sub backplane; None means broadcasts stay in-process
+        self.redis = None
+        self._pubsub = None
+        self._listener_task: asyncio.Task = None
+        # Loop running the backplane, for publishes requested from threadpool routes
+        self._loop: asyncio.AbstractEventLoop = None
+        # Set once the pub/sub connection exists (after the first subscribe)
+        self._pubsub_ready = asyncio.Event()
+
+    async def start_backplane(self, redis_url: str):
+        """Route chat broadcasts through Redis pub/sub so every worker can deliver them"""
+        import redis.asyncio as aioredis
+        
+        self.redis = aioredis.from_url(redis_url)
+        self._pubsub = self.redis.pubsub()
+        self._loop = asyncio.get_running_loop()
+        await self._pubsub.subscribe(ACCESS_CHANNEL)
+        self._pubsub_ready.set()
+        # Subscribe chats that already have local connections
+        for chat_id in self.chat_connections:
+            await self._subscribe(chat_id)
+        self._listener_task = asyncio.create_task(self._listen())
+        logger.info("WebSocket broadcasts use Redis pub/sub")
+
+    async def stop_backplane(self):
+        """Stop the Redis listener and close the connections"""
+        if self.redis is None:
+            return
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            pass
+        await self._pubsub.aclose()
+        await self.redis.aclose()
+        self.redis = self._pubsub = self._listener_task = self._loop = None
+        self._pubsub_ready.clear()
+
+    async def _subscribe(self, chat_id: int):
+        """Receive backplane broadcasts for a chat that has local connections"""
+        await self._pubsub.subscribe(f"{CHAT_CHANNEL_PREFIX}{chat_id}")
+        self._pubsub_ready.set()
+
+    def publish_access_change(self, chat_id: int, user_ids: List[int]):
+        """Have every worker drop cached access grants for a chat; safe to call from threadpool routes"""
+        if self._loop is None or not user_ids:
+            return
+        payload = b"%d\n%b" % (chat_id, b",".join(b"%d" % user_id for user_id in user_ids))
+        asyncio.run_coroutine_threadsafe(self._publish_access_change(payload), self._loop)
+
+    async def _publish_access_change(self, payload: bytes):
+        try:
+            await self.redis.publish(ACCESS_CHANNEL, payload)
+        except Exception as e:
+            logger.error("Redis publish of access change failed: %s", e)
+
+    async def _listen(self):
+        """Deliver chat broadcasts published by any worker to local connections"""
+        while True:
+            # The pub/sub connection is only opened by the first subscribe
+            await self._pubsub_ready.wait()
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Redis pub/sub receive failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            
+            if message is None:
+                continue
+            
+            # A malformed envelope is dropped; it must not end the listener
+            try:
+                self._handle_backplane_message(message)
+            except Exception as e:
+                logger.error("Dropping bad Redis message on %s: %s", message.get("channel"), e)
+
+    def _handle_backplane_message(self, message: dict):
+        """Apply one pub/sub message: an access invalidation or a chat broadcast"""
+        if message["channel"] == ACCESS_CHANNEL.encode():
+            # Envelope is "<chat_id>\n<user_id>,<user_id>,..."
+            chat_id, _, user_ids = message["data"].partition(b"\n")
+            invalidate_chat_access(int(chat_id), [int(user_id) for user_id in user_ids.split(b",")])
+            return
+        
+        # Envelope is "<exclude_user>\n<frame>" with 0 meaning nobody is excluded
+        chat_id = int(message["channel"][len(CHAT_CHANNEL_PREFIX):])
+        header, _, frame = message["data"].partition(b"\n")
+        self._fan_out(chat_id, frame, int(header))
 
-    async def connect(self, websocket: WebSocket, user_id: int, chat_id: int):
+    async def connect(self, websocket: WebSocket, user, chat_id: int):
         """Connect a user to a specific chat"""
         await websocket.accept()
+        user_id = user.id
+        
+        # Subscribe before indexing the socket, so a Redis failure leaves no half-registered connection
+        if chat_id not in self.chat_connections and self._pubsub is not None:
+            await self._subscribe(chat_id)
         
         # Initialize user connections if not exists
         if user_id not in self.active_connections:
             self.active_connections[user_id] = {}
-            self.user_websockets[user_id] = []
+            self.user_websockets[user_id] = set()
+            self.user_briefs[user_id] = UserBrief(user_id, user.username, user.full_name)
         
         # Initialize chat connections if not exists
         if chat_id not in self.active_connections[user_id]:
-            self.active_connections[user_id][chat_id] = []
+            self.active_connections[user_id][chat_id] = set()
         
         # Add websocket to connections
-        self.active_connections[user_id][chat_id].append(websocket)
-        self.user_websockets[user_id].append(websocket)
+        self.active_connections[user_id][chat_id].add(websocket)
+        self.user_websockets[user_id].add(websocket)
         self.websocket_users[websocket] = user_id
+        self.chat_connections.setdefault(chat_id, {}).setdefault(user_id, set()).add(websocket)
+        self.websocket_chats[websocket] = chat_id
+        
+        # Start the writer that drains this connection's send queue
+        queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.send_queues[websocket] = queue
+        self.writer_tasks[websocket] = asyncio.create_task(self._writer(websocket, queue))
         
-        logging.info(f"User {user_id} connected to chat {chat_id}")
+        logger.info("User %s connected to chat %s", user_id, chat_id)
         
         # Notify other users in the chat that this user joined
-        await self.broadcast_to_chat(chat_id, {
-            "type": "user_joined",
-            "user_id": user_id,
-            "chat_id": chat_id,
-            "timestamp": datetime.utcnow().isoformat()
-        }, exclude_user=user_id)
+        await self.broadcast_frame(chat_id, presence_frame(b"user_joined", user_id, chat_id), exclude_user=user_id)
 
     async def disconnect(self, websocket: WebSocket):
         """Disconnect a websocket"""
@@ -52,23 +213,47 @@ class ConnectionManager:
         
         # Remove from websocket_users mapping
         del self.websocket_users[websocket]
+        self.binary_sockets.discard(websocket)
+        
+        # Remove from the chat index
+        chat_id = self.websocket_chats.pop(websocket, None)
+        # Set when this was the chat's last local socket; it is unsubscribed once local cleanup is done
+        emptied_chat_id = None
+        chat_users = self.chat_connections.get(chat_id)
+        if chat_users is not None:
+            sockets = chat_users.get(user_id)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del chat_users[user_id]
+            if not chat_users:
+                del self.chat_connections[chat_id]
+                emptied_chat_id = chat_id
+        
+        # Stop the writer task (unless we are running inside it)
+        self.send_queues.pop(websocket, None)
+        writer_task = self.writer_tasks.pop(websocket, None)
+        if writer_task and writer_task is not asyncio.current_task():
+            writer_task.cancel()
         
         # Remove from user_websockets
         if user_id in self.user_websockets:
-            self.user_websockets[user_id] = [
-                ws for ws in self.user_websockets[user_id] if ws != websocket
-            ]
+            self.user_websockets[user_id].discard(websocket)
             
             # Clean up empty user entry
             if not self.user_websockets[user_id]:
                 del self.user_websockets[user_id]
+                self.user_briefs.pop(user_id, None)
+        
+        # Leave/stop-typing notices for every affected chat, published together below
+        notices = []
         
         # Remove from active_connections and notify chats
         if user_id in self.active_connections:
             chats_to_notify = []
-            for chat_id, websockets in self.active_connections[user_id].items():
+            for chat_id, websockets in list(self.active_connections[user_id].items()):
                 if websocket in websockets:
-                    websockets.remove(websocket)
+                    websockets.discard(websocket)
                     chats_to_notify.append(chat_id)
                     
                     # Clean up empty chat entry
@@ -81,66 +266,136 @@ class ConnectionManager:
             
             # Notify chats that user left
             for chat_id in chats_to_notify:
-                await self.broadcast_to_chat(chat_id, {
-                    "type": "user_left",
-                    "user_id": user_id,
-                    "chat_id": chat_id,
-                    "timestamp": datetime.utcnow().isoformat()
-                }, exclude_user=user_id)
+                notices.append(self.broadcast_frame(
+                    chat_id, presence_frame(b"user_left", user_id, chat_id), exclude_user=user_id
+                ))
         
         # Remove from typing indicators
-        for chat_id in list(self.typing_users.keys()):
-            if user_id in self.typing_users[chat_id]:
+        for chat_id in self.user_typing_chats.pop(user_id, ()):
+            if user_id in self.typing_users.get(chat_id, {}):
                 del self.typing_users[chat_id][user_id]
                 
                 # Notify others that user stopped typing
-                await self.broadcast_to_chat(chat_id, {
-                    "type": "typing_stopped",
-                    "user_id": user_id,
-                    "chat_id": chat_id,
-                    "timestamp": datetime.utcnow().isoformat()
-                }, exclude_user=user_id)
+                notices.append(self.broadcast_frame(
+                    chat_id, presence_frame(b"typing_stopped", user_id, chat_id), exclude_user=user_id
+                ))
                 
                 # Clean up empty chat entry
                 if not self.typing_users[chat_id]:
                     del self.typing_users[chat_id]
         
-        logging.info(f"User {user_id} disconnected")
+        # Overlap the Redis publishes instead of paying one round trip per chat
+        if notices:
+            await asyncio.gather(*notices, return_exceptions=True)
+        
+        # Best effort: a Redis error here must not undo the cleanup above. Skip it if a
+        # new connection to the chat arrived meanwhile, as it relies on the subscription
+        if emptied_chat_id is not None and self._pubsub is not None and emptied_chat_id not in self.chat_connections:
+            try:
+                await self._pubsub.unsubscribe(f"{CHAT_CHANNEL_PREFIX}{emptied_chat_id}")
+            except Exception as e:
+                logger.error("Redis unsubscribe from chat %s failed: %s", emptied_chat_id, e)
+        
+        logger.info("User %s disconnected", user_id)
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued frames to a websocket one at a time"""
+        try:
+            while True:
+                frame = await queue.get()
+                if type(frame) is bytes:
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Error sending to websocket of user %s: %s", self.websocket_users.get(websocket), e)
+            await self.disconnect(websocket)
+
+    def mark_binary(self, websocket: WebSocket):
+        """Reply to this websocket with binary frames, as its client uses them"""
+        if websocket in self.websocket_users:
+            self.binary_sockets.add(websocket)
+
+    def enqueue(self, websocket: WebSocket, frame: Union[str, bytes]) -> bool:
+        """Queue a serialized frame for a websocket; slow clients that overflow their queue are dropped"""
+        queue = self.send_queues.get(websocket)
+        if queue is None:
+            return False
+        
+        # Match the frame type the client speaks: str goes out as text, bytes as binary
+        if websocket in self.binary_sockets:
+            if type(frame) is str:
+                frame = frame.encode()
+        elif type(frame) is bytes:
+            frame = frame.decode()
+        
+        try:
+            queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            logger.warning("Send queue full for user %s, dropping connection", self.websocket_users.get(websocket))
+            # Stop queueing for this websocket right away; the close happens asynchronously
+            self.send_queues.pop(websocket, None)
+            task = asyncio.create_task(self._drop_slow_client(websocket))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+            return False
+
+    async def _drop_slow_client(self, websocket: WebSocket):
+        """Disconnect a client that can't keep up with its send queue"""
+        await self.disconnect(websocket)
+        try:
+            await websocket.close(code=SLOW_CLIENT_CLOSE_CODE, reason="Client too slow")
+        except Exception:
+            pass
 
     async def send_personal_message(self, message: dict, user_id: int):
         """Send a message to a specific user across all their connections"""
         if user_id in self.user_websockets:
-            disconnected_websockets = []
-            for websocket in self.user_websockets[user_id]:
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except Exception as e:
-                    logging.error(f"Error sending message to user {user_id}: {e}")
-                    disconnected_websockets.append(websocket)
-            
-            # Clean up disconnected websockets
-            for websocket in disconnected_websockets:
-                await self.disconnect(websocket)
+            frame = encode_frame(message)
+            for websocket in list(self.user_websockets[user_id]):
+                self.enqueue(websocket, frame)
 
     async def broadcast_to_chat(self, chat_id: int, message: dict, exclude_user: int = None):
         """Broadcast a message to all users in a specific chat"""
-        disconnected_websockets = []
+        # Serialize once and share the same frame with every recipient
+        await self.broadcast_frame(chat_id, encode_frame(message), exclude_user)
+
+    async def broadcast_frame(self, chat_id: int, frame: bytes, exclude_user: int = None):
+        """Broadcast an already serialized frame to all users in a specific chat"""
+        if self.redis is not None:
+            try:
+                await self.redis.publish(
+                    f"{CHAT_CHANNEL_PREFIX}{chat_id}", b"%d\n%b" % (exclude_user or 0, frame)
+                )
+                return
+            except Exception as e:
+                logger.error("Redis publish failed, delivering locally only: %s", e)
+        
+        self._fan_out(chat_id, frame, exclude_user)
+
+    def _fan_out(self, chat_id: int, frame: bytes, exclude_user: int = None):
+        """Queue a serialized frame for this process's connections to a chat"""
+        chat_users = self.chat_connections.get(chat_id)
+        if not chat_users:
+            return
+        
+        # Decode at most once for all text-frame clients
+        text_frame = None
         
-        for user_id, user_chats in self.active_connections.items():
+        # Walk only this chat's users; enqueue never mutates the index synchronously
+        for user_id, sockets in chat_users.items():
             if exclude_user and user_id == exclude_user:
                 continue
-                
-            if chat_id in user_chats:
-                for websocket in user_chats[chat_id]:
-                    try:
-                        await websocket.send_text(json.dumps(message))
-                    except Exception as e:
-                        logging.error(f"Error broadcasting to user {user_id} in chat {chat_id}: {e}")
-                        disconnected_websockets.append(websocket)
-        
-        # Clean up disconnected websockets
-        for websocket in disconnected_websockets:
-            await self.disconnect(websocket)
+            for websocket in sockets:
+                if websocket in self.binary_sockets:
+                    self.enqueue(websocket, frame)
+                else:
+                    if text_frame is None:
+                        text_frame = frame.decode()
+                    self.enqueue(websocket, text_frame)
 
     async def handle_typing_indicator(self, user_id: int, chat_id: int, is_typing: bool):
         """Handle typing indicators"""
@@ -151,31 +406,28 @@ class ConnectionManager:
         
         if is_typing:
             self.typing_users[chat_id][user_id] = current_time
-            message_type = "typing_started"
+            self.user_typing_chats.setdefault(user_id, set()).add(chat_id)
+            message_type = b"typing_started"
         else:
             if user_id in self.typing_users[chat_id]:
                 del self.typing_users[chat_id][user_id]
-            message_type = "typing_stopped"
+            typing_chats = self.user_typing_chats.get(user_id)
+            if typing_chats is not None:
+                typing_chats.discard(chat_id)
+                if not typing_chats:
+                    del self.user_typing_chats[user_id]
+            message_type = b"typing_stopped"
             
             # Clean up empty chat entry
             if not self.typing_users[chat_id]:
                 del self.typing_users[chat_id]
         
         # Broadcast typing status to other users in the chat
-        await self.broadcast_to_chat(chat_id, {
-            "type": message_type,
-            "user_id": user_id,
-            "chat_id": chat_id,
-            "timestamp": current_time.isoformat()
-        }, exclude_user=user_id)
+        await self.broadcast_frame(chat_id, presence_frame(message_type, user_id, chat_id), exclude_user=user_id)
 
     def get_chat_users(self, chat_id: int) -> Set[int]:
         """Get all users currently connected to a specific chat"""
-        users = set()
-        for user_id, user_chats in self.active_connections.items():
-            if chat_id in user_chats and user_chats[chat_id]:
-                users.add(user_id)
-        return users
+        return set(self.chat_connections.get(chat_id, {}))
 
     def get_user_chats(self, user_id: int) -> Set[int]:
         """Get all chats a user is currently connected to"""
@@ -191,9 +443,17 @@ class ConnectionManager:
         """Get total number of online users"""
         return len(self.user_websockets)
 
+    def get_connection_count(self) -> int:
+        """Get total number of open websocket connections"""
+        return len(self.websocket_users)
+
     def get_chat_online_users(self, chat_id: int) -> List[int]:
         """Get list of online users in a specific chat"""
         return list(self.get_chat_users(chat_id))
 
+    def get_chat_online_briefs(self, chat_id: int) -> List[UserBrief]:
+        """Get profiles of online users in a specific chat"""
+        return [self.user_briefs[user_id] for user_id in self.get_chat_users(chat_id)]
+
 # Global connection manager instance
 manager = ConnectionManager()